@@ -12,6 +12,181 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Resolve the shared MongoDB helper once per process rather than on every report call
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+try:
+    from src.utils.common import get_mongodb_connection
+except ImportError as e:
+    get_mongodb_connection = None
+    _common_import_error = e
+
+# Collection -> reference fields the report joins on, as converted by normalize_contact_ids.py.
+# The joins match ObjectIds only, and the main app still writes some of these as strings, so
+# counts are complete only once that writer is fixed; until then every new string record is
+# left out until the migration is re-run, which the warning below reports
+STRING_ID_PROBES = {
+    "contactgroups_mappings": ["contactId", "groupId"],
+    "unsubscribed_contacts": ["contactId"],
+    "invalid_contacts": ["contactId"],
+}
+
+def _string_id_fields(db):
+    """Return the joined reference fields (as collection.field) that still hold string ids."""
+    # Each probed field leads an index in create_report_indexes.py, so limit=1 stays cheap
+    return [
+        f"{collection_name}.{field}"
+        for collection_name, fields in STRING_ID_PROBES.items()
+        for field in fields
+        if db[collection_name].count_documents({field: {"$type": "string"}}, limit=1)
+    ]
+
+# Contact status -> per-group counter it increments
+STATUS_COUNT_KEYS = {
+    "active": "active_contacts",
+    "unsubscribed": "unsubscribed",
+    "undeliverable": "undeliverable",
+}
+
+def _contact_status_stages(group_query):
+    """Stages that join groups -> mappings -> contacts -> unsubscribed/invalid records.
+
+    Yields one row per (group, contact) with the contact's ``status``, plus one
+    row with a null status for each empty group. The three per-row $lookups are
+    the expensive part of the report, so callers run these stages once and
+    derive both the counts and the contact lists from the same rows. Relies on
+    groupId/contactId being stored as ObjectIds (see normalize_contact_ids.py).
+
+    Args:
+        group_query (dict): Filter selecting the organization's contact groups
+    """
+    return [
+        {"$match": group_query},
+        # Groups stream in _id order; the later stages keep each group's rows together
+        {"$sort": {"_id": 1}},
+        {
+            "$lookup": {
+                "from": "contactgroups_mappings",
+                "localField": "_id",
+                "foreignField": "groupId",
+                "pipeline": [
+                    {"$match": {"active": True}},
+                    {"$project": {"_id": 0, "contactId": 1}}
+                ],
+                "as": "mapping"
+            }
+        },
+        {"$addFields": {"mapping_count": {"$size": "$mapping"}}},
+        {"$unwind": {"path": "$mapping", "preserveNullAndEmptyArrays": True}},
+        {
+            "$lookup": {
+                "from": "contacts",
+                "localField": "mapping.contactId",
+                "foreignField": "_id",
+                "pipeline": [{"$project": {"_id": 1, "firstName": 1, "lastName": 1, "phoneNumber": 1}}],
+                "as": "contact"
+            }
+        },
+        # Keep groups without contacts so they still show up with zero counts
+        {"$unwind": {"path": "$contact", "preserveNullAndEmptyArrays": True}},
+        # Rows without a contact (empty groups) skip both probes, and contacts already
+        # known to be unsubscribed skip the invalid_contacts probe. "probe" is constant
+        # per row, so the sub-pipeline's $match is false up front for skipped rows
+        {
+            "$lookup": {
+                "from": "unsubscribed_contacts",
+                "localField": "contact._id",
+                "foreignField": "contactId",
+                "let": {"probe": {"$ne": [{"$type": "$contact"}, "missing"]}},
+                "pipeline": [
+                    {"$match": {"$expr": "$$probe", "channelId": {"$exists": True}}},
+                    {"$limit": 1},
+                    {"$project": {"_id": 1}}
+                ],
+                "as": "unsub"
+            }
+        },
+        {
+            "$lookup": {
+                "from": "invalid_contacts",
+                "localField": "contact._id",
+                "foreignField": "contactId",
+                "let": {
+                    "probe": {
+                        "$and": [
+                            {"$ne": [{"$type": "$contact"}, "missing"]},
+                            {"$eq": [{"$size": "$unsub"}, 0]}
+                        ]
+                    }
+                },
+                "pipeline": [
+                    {"$match": {"$expr": "$$probe"}},
+                    {"$limit": 1},
+                    {"$project": {"_id": 0, "errorMessages": 1, "errorDetails": 1}}
+                ],
+                "as": "invalid"
+            }
+        },
+        {
+            "$addFields": {
+                "invalid": {"$arrayElemAt": ["$invalid", 0]},
+                "status": {
+                    "$switch": {
+                        "branches": [
+                            {"case": {"$eq": [{"$type": "$contact"}, "missing"]}, "then": None},
+                            {"case": {"$gt": [{"$size": "$unsub"}, 0]}, "then": "unsubscribed"},
+                            {"case": {"$gt": [{"$size": "$invalid"}, 0]}, "then": "undeliverable"}
+                        ],
+                        "default": "active"
+                    }
+                }
+            }
+        }
+    ]
+
+def build_contact_analysis_pipeline(group_query):
+    """Build the aggregation that streams one row per (group, contact).
+
+    Each row carries its group's id, name and mapping count, the contact's
+    status and listing fields, and the error details of undeliverable
+    contacts. Counts and totals are summed by the caller while the cursor is
+    read, so no result document grows with the size of the organization.
+
+    Args:
+        group_query (dict): Filter selecting the organization's contact groups
+    """
+    return _contact_status_stages(group_query) + [
+        {
+            "$project": {
+                "_id": 0,
+                "groupId": "$_id",
+                "groupName": "$name",
+                "mapping_count": 1,
+                "status": 1,
+                "id": {"$toString": "$contact._id"},
+                "name": {
+                    "$trim": {
+                        "input": {
+                            "$concat": [
+                                {"$ifNull": ["$contact.firstName", ""]},
+                                " ",
+                                {"$ifNull": ["$contact.lastName", ""]}
+                            ]
+                        }
+                    }
+                },
+                "phone": {"$ifNull": ["$contact.phoneNumber", ""]},
+                "errors": {"$ifNull": ["$invalid.errorMessages", []]},
+                "error_details": {
+                    "$cond": [
+                        {"$eq": ["$status", "undeliverable"]},
+                        {"$ifNull": ["$invalid.errorDetails", []]},
+                        []
+                    ]
+                }
+            }
+        }
+    ]
+
 def generate_contact_analysis_report(organization_id, output_file=None, save_to_mongodb=True):
     """Generate a report analyzing contacts in an organization's groups.
     
@@ -25,8 +200,8 @@ def generate_contact_analysis_report(organization_id, output_file=None, save_to_
     # Initialize MongoDB connection using common utils function
     try:
         console.print("[cyan]Connecting to MongoDB...[/cyan]")
-        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
-        from src.utils.common import get_mongodb_connection
+        if get_mongodb_connection is None:
+            raise _common_import_error
         
         client = get_mongodb_connection()
         if not client:
@@ -49,19 +224,14 @@ def generate_contact_analysis_report(organization_id, output_file=None, save_to_
         org_id = ObjectId(organization_id)
         console.print(f"[cyan]Looking for organization with ID: {org_id} (type: {type(org_id)})[/cyan]")
         
-        # Debug: Show total organizations
-        total_orgs = db.organizations.count_documents({})
-        console.print(f"[cyan]Total organizations in database: {total_orgs}[/cyan]")
-        
         # Get organization
-        org = db.organizations.find_one({"_id": org_id})
+        org = db.organizations.find_one({"_id": org_id}, {"legalEntityName": 1})
         # console.print(f"[cyan]Organization found: {org}[/cyan]")
         if not org:
             console.print(f"[red]Organization not found with ID: {organization_id}[/red]")
-            # Debug: Show a sample organization
-            if total_orgs > 0:
-                sample_org = db.organizations.find_one({})
-                console.print(f"[cyan]Sample organization structure: {sample_org}[/cyan]")
+            # Debug: estimated count reads collection metadata instead of scanning
+            total_orgs = db.organizations.estimated_document_count()
+            console.print(f"[cyan]Total organizations in database (estimated): {total_orgs}[/cyan]")
             return
         
         org_name = org.get("legalEntityName", "Unknown")
@@ -92,6 +262,9 @@ def generate_contact_analysis_report(organization_id, output_file=None, save_to_
         "undeliverable": 0,
         "errors": {}
     }
+    total_error_rate = 0
+    # Error code -> description, keeping the first description seen
+    error_desc_map = {}
 
     # Get all contact groups for the organization
     try:
@@ -104,107 +277,101 @@ def generate_contact_analysis_report(organization_id, output_file=None, save_to_
             "active": True
         }
         console.print(f"[cyan]Searching for contact groups with query: {query}[/cyan]")
+
+        # The pipelines join on ObjectIds only, so leftover strings would silently undercount
+        stale = _string_id_fields(db)
+        if stale:
+            console.print(
+                f"[yellow]Warning: string ids found in {', '.join(stale)}; run normalize_contact_ids.py, "
+                "counts below may be incomplete[/yellow]"
+            )
         
-        # First check total count of contact groups
-        # total_groups = db.contactgroups.count_documents({})
-        # console.print(f"[cyan]Total contact groups in database: {total_groups}[/cyan]")
-        
-        # Get matching groups
-        groups = list(db.contactgroups.find(query))
+        # One streamed pass over the joined rows feeds the counts, the error breakdown and
+        # the contact lists. Contacts are only kept for the outputs that list them: the file
+        # lists active and undeliverable contacts, MongoDB only the undeliverable ones
+        if output_file:
+            listed_statuses = ("active", "undeliverable")
+        elif save_to_mongodb:
+            listed_statuses = ("undeliverable",)
+        else:
+            listed_statuses = ()
+
+        groups_by_id = {}
+        for row in db.contactgroups.aggregate(build_contact_analysis_pipeline(query), allowDiskUse=True):
+            group = groups_by_id.get(row["groupId"])
+            if group is None:
+                group = groups_by_id[row["groupId"]] = {
+                    "name": row["groupName"],
+                    "mapping_count": row["mapping_count"],
+                    "total_contacts": 0,
+                    "active_contacts": 0,
+                    "unsubscribed": 0,
+                    "undeliverable": 0,
+                    "contacts": []
+                }
+
+            status = row.get("status")
+            # Empty groups come through as a single row without a contact
+            if status is None:
+                continue
+            group["total_contacts"] += 1
+            group[STATUS_COUNT_KEYS[status]] += 1
+
+            for detail in row["error_details"]:
+                error_code = detail.get("code") or "unknown"
+                total_stats["errors"][error_code] = total_stats["errors"].get(error_code, 0) + 1
+                error_desc_map.setdefault(str(error_code), detail.get("description") or "Unknown error")
+
+            if status in listed_statuses:
+                group["contacts"].append({
+                    "id": row["id"],
+                    "name": row["name"],
+                    "phone": row["phone"],
+                    "status": status,
+                    "errors": row["errors"]
+                })
+
+        groups = list(groups_by_id.values())
         console.print(f"[cyan]Found {len(groups)} active contact groups for organization[/cyan]")
-        
-        # Debug: Show sample of groups if any exist
-        # if total_groups > 0:
-        #     sample_group = db.contactgroups.find_one({})
-        #     console.print(f"[cyan]Sample group structure: {sample_group}[/cyan]")
 
         for group in groups:
-            group_stats = {
-                "name": group["name"],
-                "total_contacts": 0,
-                "active_contacts": 0,
-                "unsubscribed": 0,
-                "undeliverable": 0,
-                "errors": {},
-                "contacts": []
-            }
+            group["error_rate"] = 0
+            if group["total_contacts"] > 0:
+                group["error_rate"] = (group["undeliverable"] / group["total_contacts"]) * 100
+            total_stats["total_contacts"] += group["total_contacts"]
+            total_stats["active_contacts"] += group["active_contacts"]
+            total_stats["unsubscribed"] += group["unsubscribed"]
+            total_stats["undeliverable"] += group["undeliverable"]
 
-            # Get all contacts in the group
-            group_contacts = list(db.contactgroups_mappings.find({"groupId": str(group["_id"]), "active": True}))
-            console.print(f"[cyan]Found {len(group_contacts)} contacts in group: {group['name']}[/cyan]")
-            # Convert string IDs to ObjectIds
-            contact_ids = [ObjectId(mapping["contactId"]) for mapping in group_contacts]
-            
-            # Get contact details
-            contacts = list(db.contacts.find({"_id": {"$in": contact_ids}}))
-            group_stats["total_contacts"] = len(contacts)
-            total_stats["total_contacts"] += len(contacts)
-
-            for contact in contacts:
-                contact_detail = {
-                    "id": str(contact["_id"]),
-                    "name": f"{contact.get('firstName', '')} {contact.get('lastName', '')}".strip(),
-                    "phone": contact.get("phoneNumber", ""),
-                    "status": "active",
-                    "errors": []
-                }
+        if total_stats["total_contacts"] > 0:
+            total_error_rate = (total_stats["undeliverable"] / total_stats["total_contacts"]) * 100
 
-                # Check if unsubscribed
-                unsubscribed = db.unsubscribed_contacts.find_one({
-                    "$or": [
-                        {"contactId": str(contact["_id"])},
-                        {"contactId": contact["_id"]}
-                    ],
-                    "channelId": {"$exists": True}
-                })
-                if unsubscribed:
-                    contact_detail["status"] = "unsubscribed"
-                    group_stats["unsubscribed"] += 1
-                    total_stats["unsubscribed"] += 1
-                    continue
-
-                # Check for delivery issues
-                invalid_contact = db.invalid_contacts.find_one({
-                    "$or": [
-                        {"contactId": str(contact["_id"])},
-                        {"contactId": contact["_id"]}
-                    ]
-                })
-                if invalid_contact:
-                    contact_detail["status"] = "undeliverable"
-                    contact_detail["errors"] = invalid_contact.get("errorMessages", [])
-                    group_stats["undeliverable"] += 1
-                    total_stats["undeliverable"] += 1
-
-                    # Track error types
-                    for error in invalid_contact.get("errorDetails", []):
-                        error_code = error.get("code", "unknown")
-                        error_desc = error.get("description", "Unknown error")
-                        group_stats["errors"][error_code] = group_stats["errors"].get(error_code, 0) + 1
-                        total_stats["errors"][error_code] = total_stats["errors"].get(error_code, 0) + 1
-                else:
-                    group_stats["active_contacts"] += 1
-                    total_stats["active_contacts"] += 1
-
-                group_stats["contacts"].append(contact_detail)
-
-            # Calculate error rate
-            error_rate = (group_stats["undeliverable"] / group_stats["total_contacts"] * 100) if group_stats["total_contacts"] > 0 else 0
-
-            # Add to group table
+        # Collect raw values first; string formatting happens once when the table is built
+        rows = []
+        for group in groups:
+            console.print(f"[cyan]Found {group['mapping_count']} contacts in group: {group['name']}[/cyan]")
+            rows.append((
+                group["name"],
+                group["total_contacts"],
+                group["active_contacts"],
+                group["unsubscribed"],
+                group["undeliverable"],
+                group["error_rate"]
+            ))
+            detailed_report.append(group)
+
+        # Add to group table
+        for name, total, active, unsubscribed, undeliverable, error_rate in rows:
             group_table.add_row(
-                group_stats["name"],
-                str(group_stats["total_contacts"]),
-                str(group_stats["active_contacts"]),
-                str(group_stats["unsubscribed"]),
-                str(group_stats["undeliverable"]),
+                name,
+                str(total),
+                str(active),
+                str(unsubscribed),
+                str(undeliverable),
                 f"{error_rate:.1f}%"
             )
 
-            detailed_report.append(group_stats)
-
         # Add totals row
-        total_error_rate = (total_stats["undeliverable"] / total_stats["total_contacts"] * 100) if total_stats["total_contacts"] > 0 else 0
         group_table.add_row(
             "[bold yellow]TOTAL[/bold yellow]",
             f"[bold yellow]{total_stats['total_contacts']}[/bold yellow]",
@@ -216,10 +383,7 @@ def generate_contact_analysis_report(organization_id, output_file=None, save_to_
 
         # Add error analysis
         for error_code, count in total_stats["errors"].items():
-            error_desc = next((err["description"] for group in detailed_report 
-                             for contact in group["contacts"] 
-                             for err in contact.get("errors", []) 
-                             if str(err.get("code")) == str(error_code)), "Unknown error")
+            error_desc = error_desc_map.get(str(error_code), "Unknown error")
             error_table.add_row(
                 str(error_code),
                 str(count),
@@ -264,10 +428,7 @@ def generate_contact_analysis_report(organization_id, output_file=None, save_to_
                         {
                             "errorCode": error_code,
                             "count": count,
-                            "description": next((err["description"] for group in detailed_report 
-                                              for contact in group["contacts"] 
-                                              for err in contact.get("errors", []) 
-                                              if str(err.get("code")) == str(error_code)), "Unknown error")
+                            "description": error_desc_map.get(str(error_code), "Unknown error")
                         } for error_code, count in total_stats["errors"].items()
                     ],
                     "groupDetails": [
@@ -277,15 +438,11 @@ def generate_contact_analysis_report(organization_id, output_file=None, save_to_
                             "activeContacts": group["active_contacts"],
                             "unsubscribed": group["unsubscribed"],
                             "undeliverable": group["undeliverable"],
-                            "errorRate": (group["undeliverable"] / group["total_contacts"] * 100) if group["total_contacts"] > 0 else 0,
+                            "errorRate": group["error_rate"],
+                            # Every undeliverable contact is embedded here, so the saved report
+                            # is still bound by the 16 MB document limit, as it was before
                             "contactsWithIssues": [
-                                {
-                                    "id": contact["id"],
-                                    "name": contact["name"],
-                                    "phone": contact["phone"],
-                                    "status": contact["status"],
-                                    "errors": contact["errors"]
-                                } for contact in group["contacts"] if contact["status"] != "active"
+                                contact for contact in group["contacts"] if contact["status"] != "active"
                             ]
                         } for group in detailed_report
                     ]
@@ -302,43 +459,43 @@ def generate_contact_analysis_report(organization_id, output_file=None, save_to_
         # Save detailed report if requested
         if output_file:
             try:
+                # Build the document in memory and write it in one call
+                parts = []
+                append = parts.append
+                append(f"# Contact Analysis Report for {org_name}\n\n")
+                append(f"Generated at: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}\n\n")
+
+                append("## Summary\n")
+                append(f"Total Contacts: {total_stats['total_contacts']}\n")
+                append(f"Active Contacts: {total_stats['active_contacts']}\n")
+                append(f"Unsubscribed Contacts: {total_stats['unsubscribed']}\n")
+                append(f"Undeliverable Contacts: {total_stats['undeliverable']}\n")
+                append(f"Overall Error Rate: {total_error_rate:.1f}%\n\n")
+
+                append("## Error Analysis\n")
+                for error_code, count in total_stats["errors"].items():
+                    error_desc = error_desc_map.get(str(error_code), "Unknown error")
+                    append(f"Error {error_code}: {count} occurrences - {error_desc}\n")
+                append("\n")
+
+                append("## Group Details\n")
+                for group in detailed_report:
+                    append(f"\n### {group['name']}\n")
+                    append(f"Total Contacts: {group['total_contacts']}\n")
+                    append(f"Active Contacts: {group['active_contacts']}\n")
+                    append(f"Unsubscribed: {group['unsubscribed']}\n")
+                    append(f"Undeliverable: {group['undeliverable']}\n")
+                    append(f"Error Rate: {group['error_rate']:.1f}%\n\n")
+
+                    append("#### Contact Details\n")
+                    for contact in group["contacts"]:
+                        append(f"- {contact['name']} ({contact['phone']}): {contact['status'].upper()}\n")
+                        if contact["errors"]:
+                            append("  Errors:\n")
+                            append("".join(f"  - {error}\n" for error in contact["errors"]))
+
                 with open(output_file, 'w') as f:
-                    f.write(f"# Contact Analysis Report for {org_name}\n\n")
-                    f.write(f"Generated at: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}\n\n")
-                    
-                    f.write("## Summary\n")
-                    f.write(f"Total Contacts: {total_stats['total_contacts']}\n")
-                    f.write(f"Active Contacts: {total_stats['active_contacts']}\n")
-                    f.write(f"Unsubscribed Contacts: {total_stats['unsubscribed']}\n")
-                    f.write(f"Undeliverable Contacts: {total_stats['undeliverable']}\n")
-                    f.write(f"Overall Error Rate: {total_error_rate:.1f}%\n\n")
-                    
-                    f.write("## Error Analysis\n")
-                    for error_code, count in total_stats["errors"].items():
-                        error_desc = next((err["description"] for group in detailed_report 
-                                         for contact in group["contacts"] 
-                                         for err in contact.get("errors", []) 
-                                         if str(err.get("code")) == str(error_code)), "Unknown error")
-                        f.write(f"Error {error_code}: {count} occurrences - {error_desc}\n")
-                    f.write("\n")
-                    
-                    f.write("## Group Details\n")
-                    for group in detailed_report:
-                        f.write(f"\n### {group['name']}\n")
-                        f.write(f"Total Contacts: {group['total_contacts']}\n")
-                        f.write(f"Active Contacts: {group['active_contacts']}\n")
-                        f.write(f"Unsubscribed: {group['unsubscribed']}\n")
-                        f.write(f"Undeliverable: {group['undeliverable']}\n")
-                        error_rate = (group['undeliverable'] / group['total_contacts'] * 100) if group['total_contacts'] > 0 else 0
-                        f.write(f"Error Rate: {error_rate:.1f}%\n\n")
-                        
-                        f.write("#### Contact Details\n")
-                        for contact in group["contacts"]:
-                            f.write(f"- {contact['name']} ({contact['phone']}): {contact['status'].upper()}\n")
-                            if contact["errors"]:
-                                f.write("  Errors:\n")
-                                for error in contact["errors"]:
-                                    f.write(f"  - {error}\n")
+                    f.write("".join(parts))
                 
                 console.print(f"[green]Detailed report saved to {output_file}[/green]")
             except Exception as e:
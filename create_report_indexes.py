@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# One-time migration: create the indexes backing the report queries
+from pymongo import ASCENDING, DESCENDING
+from rich.console import Console
+
+from normalize_contact_ids import get_mongodb_connection
+
+# Initialize console for pretty printing
+console = Console()
+
+# Equality fields first, then sort/range fields (ESR rule).
+# An entry is either a key list or a (key list, create_index options) tuple
+REPORT_INDEXES = {
+    "campaigns": [
+        # Covers the daily campaign report query (createdAt range, name/status/createdAt projection)
+        ([("createdAt", ASCENDING), ("name", ASCENDING), ("status", ASCENDING)], {"name": "campaigns_daily_report"}),
+    ],
+    "contactgroups": [
+        [("organizationId", ASCENDING), ("active", ASCENDING)],
+    ],
+    "contactgroups_mappings": [
+        [("groupId", ASCENDING), ("active", ASCENDING)],
+        # Serves the string contactId probe in contact_analysis_report.py
+        [("contactId", ASCENDING)],
+    ],
+    "unsubscribed_contacts": [
+        [("contactId", ASCENDING), ("channelId", ASCENDING)],
+    ],
+    "invalid_contacts": [
+        [("contactId", ASCENDING)],
+    ],
+    "organization_channel_report_bak": [
+        [("organizationId", ASCENDING), ("channelId", ASCENDING)],
+    ],
+    "test_twilio_messages": [
+        [("status", ASCENDING), ("direction", ASCENDING), ("date_sent", DESCENDING)],
+        [("status", ASCENDING), ("direction", ASCENDING), ("to", ASCENDING), ("date_sent", DESCENDING)],
+    ],
+}
+
+def create_report_indexes():
+    """
+    Creates the indexes used by the report scripts. create_index is a no-op
+    for indexes that already exist, so this is safe to re-run.
+    """
+    prod_client = get_mongodb_connection("PROD_MONGO_URI")
+    if not prod_client:
+        return
+
+    prod_db = prod_client["treply"]
+
+    try:
+        for collection_name, indexes in REPORT_INDEXES.items():
+            for index in indexes:
+                keys, options = index if isinstance(index, tuple) else (index, {})
+                index_name = prod_db[collection_name].create_index(keys, **options)
+                console.print(f"[green]Ensured index '{index_name}' on '{collection_name}'[/green]")
+    except Exception as e:
+        console.print(f"[red]Error creating indexes: {e}[/red]")
+    finally:
+        prod_client.close()
+
+def main():
+    console.print("[bold blue]Creating Report Indexes[/bold blue]")
+    create_report_indexes()
+
+if __name__ == "__main__":
+    main()
@@ -1,141 +1,187 @@
 #!/usr/bin/env python3
 import os
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from pymongo import MongoClient
 from rich.console import Console
 
+load_dotenv()
+
 console = Console()
 
+# Documents per cursor batch and per insert_many call
+BATCH_SIZE = 1000
+
+@functools.lru_cache(maxsize=None)
+def _client(mongo_uri):
+    # One pooled client per URI for the life of the process; failures raise and are not cached
+    client = MongoClient(mongo_uri, maxPoolSize=50, retryWrites=True)
+    try:
+        client.admin.command('ping')
+    except Exception:
+        client.close()
+        raise
+    return client
+
 def get_mongodb_connection(uri_key):
-    load_dotenv()
     mongo_uri = os.getenv(uri_key)
     if not mongo_uri:
         console.print(f"[red]{uri_key} is not set in .env[/red]")
         return None
     try:
-        client = MongoClient(mongo_uri)
-        client.admin.command('ping')
+        client = _client(mongo_uri)
         console.print(f"[green]Connected to MongoDB using {uri_key}[/green]")
         return client
     except Exception as e:
         console.print(f"[red]Connection failed: {e}[/red]")
         return None
 
-def transfer_undelivered_report_to_dev():
-    prod_client = get_mongodb_connection("PROD_MONGO_URI")
-    dev_client = get_mongodb_connection("DEV_MONGO_URI")
-    if not prod_client or not dev_client:
-        return
-
-    prod_db = prod_client["treply"]
-    messages = prod_db["test_twilio_messages"]
-
-    dev_db = dev_client["treply_dev"]
-    dev_collection = dev_db["deactivated_phone_report"]  # New collection
+# Undelivered outbound messages carrying everything the report needs
+UNDELIVERED_MATCH = {
+    "$and": [
+        {"status": "undelivered"},
+        {"direction": "outbound-api"},
+        {"error_code": {"$exists": True, "$ne": None}},
+        {"organizationId": {"$exists": True, "$ne": None}},
+        {"channelId": {"$exists": True, "$ne": None}},
+        {"to": {"$exists": True, "$ne": None}},
+        {"date_sent": {"$exists": True, "$ne": None}}
+    ]
+}
 
-    pipeline = [
-        {
-            "$match": {
-                "$and": [
-                    {"status": "undelivered"},
-                    {"direction": "outbound-api"},
-                    {"error_code": {"$exists": True, "$ne": None}},
-                    {"organizationId": {"$exists": True, "$ne": None}},
-                    {"channelId": {"$exists": True, "$ne": None}},
-                    {"to": {"$exists": True, "$ne": None}},
-                    {"date_sent": {"$exists": True, "$ne": None}}
-                ]
-            }
-        },
-        {
-            "$addFields": {
-                "date_sent_obj": {
-                    "$cond": {
-                        "if": { "$eq": [{ "$type": "$date_sent" }, "date"] },
-                        "then": "$date_sent",
-                        "else": { "$dateFromString": { "dateString": "$date_sent" } }
-                    }
-                }
-            }
-        },
+def build_deactivated_phone_stages():
+    """Stages after $match that keep the latest undelivered message per number"""
+    # Assumes date_sent is stored as a BSON date (see normalize_message_dates.py)
+    return [
         {
-            "$sort": {
+            "$project": {
+                "_id": 0,
                 "to": 1,
-                "date_sent_obj": -1
+                "date_sent": 1,
+                "organizationId": 1,
+                "channelId": 1,
+                "error_code": 1
             }
         },
         {
+            # $top keeps only the latest message per number, avoiding a full sort
             "$group": {
                 "_id": "$to",
-                "latest_date_sent": { "$first": "$date_sent" },
-                "organizationId": { "$first": "$organizationId" },
-                "channelId": { "$first": "$channelId" },
-                "error_code": { "$first": "$error_code" }
-            }
-        },
-        {
-            "$lookup": {
-                "from": "organization_channel_report_bak",
-                "let": {
-                    "orgId": "$organizationId",
-                    "chanId": "$channelId"
-                },
-                "pipeline": [
-                    {
-                        "$match": {
-                            "$expr": {
-                                "$and": [
-                                    { "$eq": ["$organizationId", "$$orgId"] },
-                                    { "$eq": ["$channelId", "$$chanId"] }
-                                ]
-                            }
-                        }
-                    },
-                    { "$limit": 1 },
-                    {
-                        "$project": {
-                            "organizationName": 1,
-                            "channelName": 1,
-                            "_id": 0
+                "latest": {
+                    "$top": {
+                        "sortBy": { "date_sent": -1 },
+                        "output": {
+                            "date_sent": "$date_sent",
+                            "organizationId": "$organizationId",
+                            "channelId": "$channelId",
+                            "error_code": "$error_code"
                         }
                     }
-                ],
-                "as": "org_info"
-            }
-        },
-        {
-            "$unwind": {
-                "path": "$org_info",
-                "preserveNullAndEmptyArrays": True
+                }
             }
         },
         {
             "$project": {
                 "_id": 0,
                 "to": "$_id",
-                "date_sent": "$latest_date_sent",
-                "organizationId": 1,
-                "channelId": 1,
-                "error_code": 1,
-                "organizationName": { "$ifNull": ["$org_info.organizationName", ""] },
-                "channelName": { "$ifNull": ["$org_info.channelName", ""] }
+                "date_sent": "$latest.date_sent",
+                "organizationId": "$latest.organizationId",
+                "channelId": "$latest.channelId",
+                "error_code": "$latest.error_code"
             }
         }
     ]
 
+def fetch_org_channel_map(db):
+    """Loads organization/channel names keyed by (organizationId, channelId), keeping the first match"""
+    org_map = {}
+    cursor = db["organization_channel_report_bak"].find(
+        {}, {"_id": 0, "organizationId": 1, "channelId": 1, "organizationName": 1, "channelName": 1}
+    )
+    for doc in cursor:
+        org_map.setdefault((doc.get("organizationId"), doc.get("channelId")), doc)
+    return org_map
+
+def add_org_channel_names(results, org_map):
+    """Fills organizationName/channelName on each report row from the prefetched map"""
+    for doc in results:
+        info = org_map.get((doc["organizationId"], doc["channelId"]), {})
+        doc["organizationName"] = info.get("organizationName") or ""
+        doc["channelName"] = info.get("channelName") or ""
+    return results
+
+def iter_batches(cursor, batch_size=BATCH_SIZE):
+    """Yields lists of up to batch_size documents from a cursor"""
+    while True:
+        batch = list(itertools.islice(cursor, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def insert_batches(collection, batches):
+    """Inserts batches on a worker thread so the next batch downloads while the previous one uploads"""
+    inserted = 0
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        for batch in batches:
+            # At most one insert in flight; result() re-raises insert errors here
+            if pending:
+                inserted += len(pending.result().inserted_ids)
+            pending = executor.submit(collection.insert_many, batch, ordered=False, bypass_document_validation=True)
+        if pending:
+            inserted += len(pending.result().inserted_ids)
+    return inserted
+
+def connect_prod_and_dev():
+    """Opens the prod and dev connections concurrently; returns (prod_client, dev_client)"""
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        prod_future = executor.submit(get_mongodb_connection, "PROD_MONGO_URI")
+        dev_future = executor.submit(get_mongodb_connection, "DEV_MONGO_URI")
+        return prod_future.result(), dev_future.result()
+
+def warn_on_string_dates(messages):
+    """Warns when undelivered messages hold string date_sent values, which the report pipelines skip or misorder"""
+    # The pipelines only handle BSON dates, so the reports are complete only once the main app
+    # stops writing string dates; until then new strings need another normalize_message_dates.py run.
+    # The {status, direction, date_sent} index serves this probe and limit=1 stops at the first hit
+    if messages.count_documents(
+        {"status": "undelivered", "direction": "outbound-api", "date_sent": {"$type": "string"}}, limit=1
+    ):
+        console.print(
+            "[yellow]Warning: string date_sent values found in undelivered messages; run "
+            "normalize_message_dates.py, those messages are missing or misordered in this report[/yellow]"
+        )
+
+def transfer_undelivered_report_to_dev():
+    prod_client, dev_client = connect_prod_and_dev()
+    if not prod_client or not dev_client:
+        return
+
+    prod_db = prod_client["treply"]
+    messages = prod_db["test_twilio_messages"]
+
+    dev_db = dev_client["treply_dev"]
+    dev_collection = dev_db["deactivated_phone_report"]  # New collection
+
+    pipeline = [{"$match": UNDELIVERED_MATCH}] + build_deactivated_phone_stages()
+
     try:
-        results = list(messages.aggregate(pipeline))
-        if results:
-            dev_collection.insert_many(results)
-            console.print(f"[green]Inserted {len(results)} documents into 'deactivated_phone_report' collection in dev DB[/green]")
+        warn_on_string_dates(messages)
+        org_map = fetch_org_channel_map(prod_db)
+        # Prod and dev are separate clusters, so $merge/$out cannot write across;
+        # stream the cursor instead so only a couple of batches are held in memory
+        cursor = messages.aggregate(pipeline, allowDiskUse=True, batchSize=BATCH_SIZE)
+        batches = (add_org_channel_names(batch, org_map) for batch in iter_batches(cursor))
+        inserted = insert_batches(dev_collection, batches)
+        if inserted:
+            console.print(f"[green]Inserted {inserted} documents into 'deactivated_phone_report' collection in dev DB[/green]")
         else:
             console.print("[yellow]No matching undelivered messages found.[/yellow]")
 
     except Exception as e:
         console.print(f"[red]Error during aggregation/insertion: {e}[/red]")
-    finally:
-        prod_client.close()
-        dev_client.close()
 
 def main():
     console.print("[bold blue]Transferring Undelivered Phone Numbers Report to Dev DB[/bold blue]")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Runs the all-time and daily deactivated phone reports from a single aggregation
+from concurrent.futures import ThreadPoolExecutor
+from rich.console import Console
+
+from deactivated_contacts_report import (
+    BATCH_SIZE,
+    UNDELIVERED_MATCH,
+    add_org_channel_names,
+    connect_prod_and_dev,
+    fetch_org_channel_map,
+    iter_batches,
+    warn_on_string_dates,
+)
+from everyday_job_deactivated_phone_report import get_yesterday_window
+
+# Initialize console for pretty printing
+console = Console()
+
+def build_combined_report_pipeline(yesterday_start, yesterday_end):
+    """
+    Builds one aggregation that emits the rows of both reports, tagged by "report"
+    Args:
+        yesterday_start (datetime): Inclusive start of the daily window
+        yesterday_end (datetime): Exclusive end of the daily window
+    Returns:
+        list: Pipeline yielding "allTime" rows (latest message per number) and
+        "yesterday" rows (per number/org/channel within the window)
+    """
+    in_window = {
+        "$and": [
+            {"$gte": ["$date_sent", yesterday_start]},
+            {"$lt": ["$date_sent", yesterday_end]}
+        ]
+    }
+    return [
+        {"$match": UNDELIVERED_MATCH},
+        {
+            "$project": {
+                "_id": 0,
+                "to": 1,
+                "date_sent": 1,
+                "organizationId": 1,
+                "channelId": 1,
+                "error_code": 1,
+                "yesterday": in_window
+            }
+        },
+        # Per number/org/channel: the latest message overall, and the latest one in the window
+        # (sorting on the window flag first puts in-window messages on top)
+        {
+            "$group": {
+                "_id": {"to": "$to", "organizationId": "$organizationId", "channelId": "$channelId"},
+                "latest": {
+                    "$top": {
+                        "sortBy": {"date_sent": -1},
+                        "output": {"date_sent": "$date_sent", "error_code": "$error_code"}
+                    }
+                },
+                "latest_yesterday": {
+                    "$top": {
+                        "sortBy": {"yesterday": -1, "date_sent": -1},
+                        "output": {"date_sent": "$date_sent", "error_code": "$error_code"}
+                    }
+                },
+                "yesterday_count": {"$sum": {"$cond": ["$yesterday", 1, 0]}}
+            }
+        },
+        # Per number: the all-time row plus one daily row per org/channel active in the window
+        {
+            "$group": {
+                "_id": "$_id.to",
+                "latest": {
+                    "$top": {
+                        "sortBy": {"latest.date_sent": -1},
+                        "output": {
+                            "date_sent": "$latest.date_sent",
+                            "organizationId": "$_id.organizationId",
+                            "channelId": "$_id.channelId",
+                            "error_code": "$latest.error_code"
+                        }
+                    }
+                },
+                "daily": {
+                    "$push": {
+                        "$cond": [
+                            {"$gt": ["$yesterday_count", 0]},
+                            {
+                                "report": "yesterday",
+                                "to": "$_id.to",
+                                "date_sent": "$latest_yesterday.date_sent",
+                                "organizationId": "$_id.organizationId",
+                                "channelId": "$_id.channelId",
+                                "error_code": "$latest_yesterday.error_code",
+                                "error_count": "$yesterday_count"
+                            },
+                            None
+                        ]
+                    }
+                }
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "rows": {
+                    "$concatArrays": [
+                        [{
+                            "report": "allTime",
+                            "to": "$_id",
+                            "date_sent": "$latest.date_sent",
+                            "organizationId": "$latest.organizationId",
+                            "channelId": "$latest.channelId",
+                            "error_code": "$latest.error_code"
+                        }],
+                        {"$filter": {"input": "$daily", "cond": {"$ne": ["$$this", None]}}}
+                    ]
+                }
+            }
+        },
+        {"$unwind": "$rows"},
+        {"$replaceWith": "$rows"}
+    ]
+
+def insert_report(collection, documents):
+    """
+    Inserts report documents into a dev collection
+    Args:
+        collection (Collection): Destination collection
+        documents (list): Documents to insert
+    Returns:
+        int: Number of inserted documents
+    """
+    if not documents:
+        return 0
+    inserted = collection.insert_many(documents, ordered=False, bypass_document_validation=True)
+    return len(inserted.inserted_ids)
+
+def run_deactivated_phone_reports():
+    """
+    Scans undelivered messages once and writes both the all-time and
+    yesterday reports to the dev database.
+    Rows of both reports come back tagged on one streamed cursor, so no
+    single result document (and its 16 MB limit) is involved. The daily
+    rows are derived from the full undelivered scan instead of the
+    date_sent range scan the standalone daily script uses, which makes
+    this job cheaper only when both reports are needed; run
+    everyday_job_deactivated_phone_report.py for the daily report alone.
+    """
+    prod_client, dev_client = connect_prod_and_dev()
+    if not prod_client or not dev_client:
+        return
+
+    prod_db = prod_client["treply"]
+    messages = prod_db["test_twilio_messages"]
+    dev_db = dev_client["treply_dev"]
+    all_time_collection = dev_db["deactivated_phone_report"]
+    daily_collection = dev_db["daily_undelivered_reports"]
+
+    yesterday, yesterday_start, yesterday_end = get_yesterday_window()
+    pipeline = build_combined_report_pipeline(yesterday_start, yesterday_end)
+
+    try:
+        warn_on_string_dates(messages)
+        org_map = fetch_org_channel_map(prod_db)
+        report_date = yesterday.strftime("%Y-%m-%d")
+        cursor = messages.aggregate(pipeline, allowDiskUse=True, batchSize=BATCH_SIZE)
+
+        all_time_count = 0
+        daily_count = 0
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for batch in iter_batches(cursor):
+                add_org_channel_names(batch, org_map)
+                all_time_rows, daily_rows = [], []
+                for doc in batch:
+                    if doc.pop("report") == "yesterday":
+                        doc["report_date"] = report_date
+                        daily_rows.append(doc)
+                    else:
+                        all_time_rows.append(doc)
+
+                all_time_future = executor.submit(insert_report, all_time_collection, all_time_rows)
+                daily_future = executor.submit(insert_report, daily_collection, daily_rows)
+                all_time_count += all_time_future.result()
+                daily_count += daily_future.result()
+
+        console.print(f"[green]Inserted {all_time_count} documents into 'deactivated_phone_report'[/green]")
+        console.print(f"[green]Inserted {daily_count} documents into 'daily_undelivered_reports'[/green]")
+    except Exception as e:
+        console.print(f"[red]Error during aggregation or insertion: {e}[/red]")
+
+def main():
+    console.print("[bold blue]Writing Deactivated Phone Reports to Dev DB[/bold blue]")
+    run_deactivated_phone_reports()
+
+if __name__ == "__main__":
+    main()
@@ -1,88 +1,66 @@
 #!/usr/bin/env python3
 # Import required libraries
-import os
-from datetime import datetime, timedelta
-from dotenv import load_dotenv
-from pymongo import MongoClient
+from datetime import datetime, timedelta, timezone
 from rich.console import Console
 
+# Connection, name lookup and batching helpers are shared with the all-time report
+from deactivated_contacts_report import (
+    BATCH_SIZE,
+    add_org_channel_names,
+    connect_prod_and_dev,
+    fetch_org_channel_map,
+    insert_batches,
+    iter_batches,
+    warn_on_string_dates,
+)
+
 # Initialize console for pretty printing
 console = Console()
 
-def get_mongodb_connection(env_var):
+def get_yesterday_window():
     """
-    Establishes connection to a MongoDB database using the specified environment variable
-    Args:
-        env_var (str): Name of the environment variable containing the Mongo URI
+    Computes the reporting window for the previous UTC calendar day
     Returns:
-        MongoClient: MongoDB client object if connection successful, None otherwise
+        tuple: (yesterday, yesterday_start, yesterday_end) datetimes, where
+        yesterday_end is the exclusive upper bound (midnight today, UTC)
     """
-    load_dotenv()
-    mongo_uri = os.getenv(env_var)
-
-    if not mongo_uri:
-        console.print(f"[red]{env_var} is not set in .env[/red]")
-        return None
+    yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+    # yesterday = datetime(2025, 3, 30, tzinfo=timezone.utc)  # Optional manual override
 
-    try:
-        client = MongoClient(mongo_uri)
-        client.admin.command('ping')
-        console.print(f"[green]Connected to MongoDB using {env_var}[/green]")
-        return client
-    except Exception as e:
-        console.print(f"[red]Connection failed: {e}[/red]")
-        return None
+    yesterday_start = datetime(yesterday.year, yesterday.month, yesterday.day, tzinfo=timezone.utc)
+    yesterday_end = yesterday_start + timedelta(days=1)
+    return yesterday, yesterday_start, yesterday_end
 
-def process_and_write_undelivered_report_to_dev():
+def build_yesterday_match(yesterday_start, yesterday_end):
     """
-    Processes undelivered message data from prod and inserts the summary into dev database
+    Builds the $match filter for undelivered messages sent yesterday.
+    Assumes date_sent is stored as a BSON date (see normalize_message_dates.py)
     """
-    # Connect to production and development databases
-    prod_client = get_mongodb_connection("PROD_MONGO_URI")
-    dev_client = get_mongodb_connection("DEV_MONGO_URI")
+    return {
+        "$and": [
+            {"status": "undelivered"},
+            {"direction": "outbound-api"},
+            {"error_code": {"$exists": True, "$ne": None}},
+            {"organizationId": {"$exists": True, "$ne": None}},
+            {"channelId": {"$exists": True, "$ne": None}},
+            {"to": {"$exists": True, "$ne": None}},
+            {"date_sent": {"$gte": yesterday_start, "$lt": yesterday_end}}
+        ]
+    }
 
-    if not prod_client or not dev_client:
-        return
-
-    prod_db = prod_client["treply"]
-    dev_db = dev_client["treply_dev"]
-    messages = prod_db["test_twilio_messages"]
-    report_collection = dev_db["daily_undelivered_reports"]
-
-    yesterday = datetime.now() - timedelta(days=1)
-    # yesterday = datetime(2025, 3, 30)  # Optional manual override
-
-    yesterday_start = datetime(yesterday.year, yesterday.month, yesterday.day, 0, 0, 0)
-    yesterday_end = datetime(yesterday.year, yesterday.month, yesterday.day, 23, 59, 59, 999999)
-
-    pipeline = [
-        {
-            "$match": {
-                "$and": [
-                    {"status": "undelivered"},
-                    {"direction": "outbound-api"},
-                    {"error_code": {"$exists": True, "$ne": None}},
-                    {"organizationId": {"$exists": True, "$ne": None}},
-                    {"channelId": {"$exists": True, "$ne": None}},
-                    {"to": {"$exists": True, "$ne": None}},
-                    {
-                        "$or": [
-                            {"date_sent": {"$gte": yesterday_start, "$lte": yesterday_end}},
-                            {"date_sent": {"$regex": f"^{yesterday.strftime('%Y-%m-%d')}"}}
-                        ]
-                    }
-                ]
-            }
-        },
+def build_daily_report_stages():
+    """
+    Builds the stages after $match that summarize undelivered messages per number/org/channel
+    """
+    return [
         {
-            "$addFields": {
-                "date_sent_obj": {
-                    "$cond": {
-                        "if": {"$eq": [{"$type": "$date_sent"}, "date"]},
-                        "then": "$date_sent",
-                        "else": {"$dateFromString": {"dateString": "$date_sent"}}
-                    }
-                }
+            "$project": {
+                "_id": 1,
+                "to": 1,
+                "date_sent": 1,
+                "organizationId": 1,
+                "channelId": 1,
+                "error_code": 1
             }
         },
         {
@@ -90,7 +68,7 @@ def process_and_write_undelivered_report_to_dev():
                 "to": 1,
                 "organizationId": 1,
                 "channelId": 1,
-                "date_sent_obj": -1,
+                "date_sent": -1,
                 "_id": 1
             }
         },
@@ -106,36 +84,6 @@ def process_and_write_undelivered_report_to_dev():
                 "error_count": {"$sum": 1}
             }
         },
-        {
-            "$lookup": {
-                "from": "organization_channel_report_bak",
-                "let": {
-                    "orgId": "$_id.organizationId",
-                    "chanId": "$_id.channelId"
-                },
-                "pipeline": [
-                    {
-                        "$match": {
-                            "$expr": {
-                                "$and": [
-                                    {"$eq": ["$organizationId", "$$orgId"]},
-                                    {"$eq": ["$channelId", "$$chanId"]}
-                                ]
-                            }
-                        }
-                    },
-                    {"$limit": 1},
-                    {"$project": {"organizationName": 1, "channelName": 1, "_id": 0}}
-                ],
-                "as": "org_info"
-            }
-        },
-        {
-            "$unwind": {
-                "path": "$org_info",
-                "preserveNullAndEmptyArrays": True
-            }
-        },
         {
             "$project": {
                 "_id": 0,
@@ -144,9 +92,7 @@ def process_and_write_undelivered_report_to_dev():
                 "organizationId": "$_id.organizationId",
                 "channelId": "$_id.channelId",
                 "error_code": 1,
-                "error_count": 1,
-                "organizationName": {"$ifNull": ["$org_info.organizationName", ""]},
-                "channelName": {"$ifNull": ["$org_info.channelName", ""]}
+                "error_count": 1
             }
         },
         {
@@ -154,20 +100,48 @@ def process_and_write_undelivered_report_to_dev():
         }
     ]
 
+def process_and_write_undelivered_report_to_dev():
+    """
+    Processes undelivered message data from prod and inserts the summary into dev database
+    """
+    # Connect to production and development databases
+    prod_client, dev_client = connect_prod_and_dev()
+
+    if not prod_client or not dev_client:
+        return
+
+    prod_db = prod_client["treply"]
+    dev_db = dev_client["treply_dev"]
+    messages = prod_db["test_twilio_messages"]
+    report_collection = dev_db["daily_undelivered_reports"]
+
+    yesterday, yesterday_start, yesterday_end = get_yesterday_window()
+
+    pipeline = [
+        {"$match": build_yesterday_match(yesterday_start, yesterday_end)}
+    ] + build_daily_report_stages()
+
     try:
-        results = list(messages.aggregate(pipeline))
-        if results:
-            for doc in results:
-                doc["report_date"] = yesterday.strftime("%Y-%m-%d")
-            inserted = report_collection.insert_many(results)
-            console.print(f"[green]Inserted {len(inserted.inserted_ids)} documents into 'daily_undelivered_reports'[/green]")
+        warn_on_string_dates(messages)
+        org_map = fetch_org_channel_map(prod_db)
+        report_date = yesterday.strftime("%Y-%m-%d")
+        # Streamed into dev batch by batch, as in deactivated_contacts_report
+        cursor = messages.aggregate(pipeline, allowDiskUse=True, batchSize=BATCH_SIZE)
+
+        def prepared_batches():
+            for batch in iter_batches(cursor):
+                add_org_channel_names(batch, org_map)
+                for doc in batch:
+                    doc["report_date"] = report_date
+                yield batch
+
+        inserted = insert_batches(report_collection, prepared_batches())
+        if inserted:
+            console.print(f"[green]Inserted {inserted} documents into 'daily_undelivered_reports'[/green]")
         else:
             console.print("[yellow]No undelivered records found for yesterday.[/yellow]")
     except Exception as e:
         console.print(f"[red]Error during aggregation or insertion: {e}[/red]")
-    finally:
-        prod_client.close()
-        dev_client.close()
 
 def main():
     console.print("[bold blue]Writing Undelivered Phone Numbers Report to Dev DB[/bold blue]")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# One-time migration: store every contact/group reference as an ObjectId
+import os
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from rich.console import Console
+
+# Initialize console for pretty printing
+console = Console()
+
+# Hex strings that $convert can turn into an ObjectId
+OBJECT_ID_PATTERN = "^[0-9a-fA-F]{24}$"
+
+# Collection -> reference fields that may still hold string ids
+ID_FIELDS = {
+    "unsubscribed_contacts": ["contactId"],
+    "invalid_contacts": ["contactId"],
+    "contactgroups_mappings": ["contactId", "groupId"],
+}
+
+def get_mongodb_connection(env_var):
+    """
+    Establishes connection to a MongoDB database using the specified environment variable
+    Args:
+        env_var (str): Name of the environment variable containing the Mongo URI
+    Returns:
+        MongoClient: MongoDB client object if connection successful, None otherwise
+    """
+    load_dotenv()
+    mongo_uri = os.getenv(env_var)
+
+    if not mongo_uri:
+        console.print(f"[red]{env_var} is not set in .env[/red]")
+        return None
+
+    try:
+        client = MongoClient(mongo_uri)
+        client.admin.command('ping')
+        console.print(f"[green]Connected to MongoDB using {env_var}[/green]")
+        return client
+    except Exception as e:
+        console.print(f"[red]Connection failed: {e}[/red]")
+        return None
+
+def add_validator(db, collection_name, schema):
+    """
+    Adds a $jsonSchema validator to a collection, keeping any validator it already has
+    Args:
+        db (Database): Database holding the collection
+        collection_name (str): Collection to modify
+        schema (dict): $jsonSchema document to require
+    """
+    info = next(db.list_collections(filter={"name": collection_name}), {})
+    options = info.get("options", {})
+    existing = options.get("validator")
+    new_validator = {"$jsonSchema": schema}
+
+    if not existing:
+        validator = new_validator
+        # The main app still writes some references as strings; log those instead of rejecting the write
+        validation_action = "warn"
+    elif new_validator in existing.get("$and", [existing]):
+        console.print(f"[yellow]Validator on '{collection_name}' already includes this schema[/yellow]")
+        return
+    else:
+        validator = {"$and": existing.get("$and", [existing]) + [new_validator]}
+        # Keep the existing validator's enforcement as it was
+        validation_action = options.get("validationAction", "error")
+
+    # Moderate level skips validation on updates to documents that already fail it,
+    # so values the migration had to leave unconverted do not block edits to those documents
+    db.command({
+        "collMod": collection_name,
+        "validator": validator,
+        "validationLevel": options.get("validationLevel", "moderate"),
+        "validationAction": validation_action
+    })
+    console.print(f"[green]Added validator on '{collection_name}' (action: {validation_action})[/green]")
+
+def normalize_contact_ids():
+    """
+    Converts hex string ids to ObjectIds, reports the strings that could not be
+    converted and adds a validator that flags new string ids
+    """
+    prod_client = get_mongodb_connection("PROD_MONGO_URI")
+    if not prod_client:
+        return
+
+    prod_db = prod_client["treply"]
+
+    try:
+        for collection_name, fields in ID_FIELDS.items():
+            collection = prod_db[collection_name]
+            for field in fields:
+                # Only hex strings are converted; onError keeps the value so one bad id cannot abort the update
+                result = collection.update_many(
+                    {field: {"$type": "string", "$regex": OBJECT_ID_PATTERN}},
+                    [{"$set": {field: {"$convert": {"input": f"${field}", "to": "objectId", "onError": f"${field}"}}}}]
+                )
+                console.print(f"[green]Converted {result.modified_count} '{field}' values in '{collection_name}'[/green]")
+
+                remaining = collection.count_documents({field: {"$type": "string"}})
+                if remaining:
+                    console.print(f"[yellow]{remaining} '{field}' values in '{collection_name}' are still strings and were left as-is[/yellow]")
+
+            add_validator(prod_db, collection_name, {
+                "properties": {field: {"bsonType": "objectId"} for field in fields}
+            })
+    except Exception as e:
+        console.print(f"[red]Error normalizing contact ids: {e}[/red]")
+    finally:
+        prod_client.close()
+
+def main():
+    console.print("[bold blue]Normalizing Contact Id Types[/bold blue]")
+    normalize_contact_ids()
+
+if __name__ == "__main__":
+    main()
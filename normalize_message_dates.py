@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# One-time migration: store test_twilio_messages.date_sent as a BSON date
+from rich.console import Console
+
+from normalize_contact_ids import add_validator, get_mongodb_connection
+
+# Initialize console for pretty printing
+console = Console()
+
+def normalize_message_dates():
+    """
+    Converts string date_sent values to dates, reports the strings that could
+    not be parsed and adds a validator that flags new string dates
+    """
+    prod_client = get_mongodb_connection("PROD_MONGO_URI")
+    if not prod_client:
+        return
+
+    prod_db = prod_client["treply"]
+    messages = prod_db["test_twilio_messages"]
+
+    try:
+        # onError keeps unparseable strings, so one bad value cannot abort the update
+        result = messages.update_many(
+            {"date_sent": {"$type": "string"}},
+            [{"$set": {"date_sent": {
+                "$convert": {"input": "$date_sent", "to": "date", "onError": "$date_sent", "onNull": None}
+            }}}]
+        )
+        console.print(f"[green]Converted {result.modified_count} 'date_sent' values in 'test_twilio_messages'[/green]")
+
+        remaining = messages.count_documents({"date_sent": {"$type": "string"}})
+        if remaining:
+            console.print(f"[yellow]{remaining} 'date_sent' values could not be parsed and were left as strings[/yellow]")
+
+        add_validator(prod_db, "test_twilio_messages", {
+            "properties": {"date_sent": {"bsonType": ["date", "null"]}}
+        })
+    except Exception as e:
+        console.print(f"[red]Error normalizing message dates: {e}[/red]")
+    finally:
+        prod_client.close()
+
+def main():
+    console.print("[bold blue]Normalizing Message Dates[/bold blue]")
+    normalize_message_dates()
+
+if __name__ == "__main__":
+    main()
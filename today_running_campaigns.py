@@ -1,26 +1,70 @@
 #!/usr/bin/env python3
 import os
+import io
 import csv
-from datetime import datetime
+from html import escape
+import logging
+import functools
+import time
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 from rich.console import Console
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail, Attachment, FileContent, FileName, FileType, Disposition
+from python_http_client.exceptions import HTTPError
 import base64
+import gzip
+
+# Load .env once and bind configuration at import time
+load_dotenv()
+MONGO_URI = os.getenv("PROD_MONGO_URI")
+SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
+EMAIL_SENDER = os.getenv("EMAIL_SENDER")
+EMAIL_SENDER_NAME = os.getenv("EMAIL_SENDER_NAME", "Campaign Bot")
+# EMAIL_RECIPIENT may hold several comma-separated addresses
+EMAIL_RECIPIENTS = [email.strip() for email in os.getenv("EMAIL_RECIPIENT", "").split(",") if email.strip()]
+
+REQUIRED_SETTINGS = {
+    "PROD_MONGO_URI": MONGO_URI,
+    "SENDGRID_API_KEY": SENDGRID_API_KEY,
+    "EMAIL_SENDER": EMAIL_SENDER,
+    "EMAIL_RECIPIENT": EMAIL_RECIPIENTS,
+}
+
+# One retry on SendGrid 5xx, waiting SEND_RETRY_DELAY * 2 ** attempt seconds
+SEND_RETRIES = 1
+SEND_RETRY_DELAY = 2
 
 # Initialize console for output
 console = Console()
+# Plain logging for per-campaign lines; rich markup rendering is reserved for the summary
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=1)
+def _client(mongo_uri):
+    # Process-wide pooled client, pinged once; failures raise and are not cached
+    client = MongoClient(mongo_uri, maxPoolSize=10, serverSelectionTimeoutMS=5000)
+    try:
+        client.admin.command('ping')
+    except Exception:
+        client.close()
+        raise
+    return client
+
+@functools.lru_cache(maxsize=1)
+def _sendgrid_client(api_key):
+    # Cached only to skip rebuilding the client per send; python_http_client opens a new
+    # urllib connection (Connection: close) for every request, so no TLS session is reused
+    return SendGridAPIClient(api_key)
 
 def get_mongodb_connection():
-    load_dotenv()
-    mongo_uri = os.getenv("PROD_MONGO_URI")
-    if not mongo_uri:
+    if not MONGO_URI:
         console.print("[red]PROD_MONGO_URI is not set in .env[/red]")
         return None
     try:
-        client = MongoClient(mongo_uri)
-        client.admin.command('ping')
+        client = _client(MONGO_URI)
         console.print("[green]Connected to MongoDB successfully[/green]")
         return client
     except Exception as e:
@@ -32,7 +76,7 @@ def generate_html_table(campaigns):
     if not campaigns:
         return "<p>No campaigns created today.</p>"
 
-    html = """
+    parts = ["""
     <h2>Campaign Report for Today</h2>
     <table border="1" cellpadding="5" cellspacing="0" style="border-collapse: collapse; font-family: Arial, sans-serif;">
       <thead>
@@ -43,141 +87,162 @@ def generate_html_table(campaigns):
         </tr>
       </thead>
       <tbody>
-    """
-    for campaign in campaigns:
-        html += f"""
+    """]
+    parts.extend(
+        f"""
         <tr>
-          <td>{campaign['name']}</td>
-          <td>{campaign['status']}</td>
-          <td>{campaign['createdAt']}</td>
+          <td>{escape(str(campaign.get('name', '')), quote=False)}</td>
+          <td>{escape(str(campaign.get('status', '')), quote=False)}</td>
+          <td>{escape(str(campaign.get('createdAt', '')), quote=False)}</td>
         </tr>
         """
-    html += """
+        for campaign in campaigns
+    )
+    parts.append("""
       </tbody>
     </table>
-    """
-    return html
+    """)
+    return "".join(parts)
 
-def generate_campaign_report():
+def generate_campaign_report(report_date):
+    """Write the CSV of campaigns created on report_date (UTC) and return (path, rows, csv_bytes)"""
     client = get_mongodb_connection()
     if not client:
         return None
 
-    try:
-        db = client["treply"]
-        campaigns_collection = db["campaigns"]
-
-        utc_today_str = datetime.utcnow().strftime('%Y-%m-%d')
-        console.print(f"[blue]Looking for campaigns created on: {utc_today_str} (UTC)[/blue]")
-
-        pipeline = [
-            {
-                "$addFields": {
-                    "createdDate": {
-                        "$dateToString": {
-                            "format": "%Y-%m-%d",
-                            "date": "$createdAt"
-                        }
-                    }
-                }
-            },
-            {"$match": {"createdDate": utc_today_str}},
-            {"$project": {"_id": 0, "name": 1, "status": 1, "createdAt": 1}}
-        ]
-
-        results = list(campaigns_collection.aggregate(pipeline))
-
-        for campaign in results:
-            if isinstance(campaign.get('createdAt'), datetime):
-                campaign['createdAt'] = campaign['createdAt'].strftime('%Y-%m-%d %H:%M:%S')
+    campaigns_collection = client["treply"]["campaigns"]
 
-        output_file = f"campaign_report_{utc_today_str}.csv"
-        with open(output_file, 'w', newline='') as csvfile:
-            fieldnames = ['name', 'status', 'createdAt']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(results)
+    utc_today_str = report_date.isoformat()
+    console.print(f"[blue]Looking for campaigns created on: {utc_today_str} (UTC)[/blue]")
 
-        console.print(f"[green]Report generated: {output_file}[/green]")
-        console.print(f"[green]Total campaigns created today: {len(results)}[/green]")
+    # Range on the raw createdAt date so the campaigns_daily_report index can be used
+    day_start = datetime(report_date.year, report_date.month, report_date.day, tzinfo=timezone.utc)
+    day_end = day_start + timedelta(days=1)
 
-        if results:
-            console.print("[yellow]Campaigns created today:[/yellow]")
-            for c in results:
-                console.print(f"- {c['name']}")
-        else:
-            console.print("[red]No campaigns created today.[/red]")
+    # Single pass over the cursor: format, write the CSV row and keep it for the email body.
+    # The CSV is built in memory so the email can attach it without re-reading the file
+    results = []
+    output_file = f"campaign_report_{utc_today_str}.csv"
+    csv_buffer = io.StringIO(newline='')
+    # Fixed three-column schema, so write plain tuples rather than going through DictWriter
+    writer = csv.writer(csv_buffer)
+    writer.writerow(('name', 'status', 'createdAt'))
 
-        return output_file, results
+    # find() only builds the cursor; batches are fetched while iterating, so the loop is guarded too
+    try:
+        # Plain match + projection, so find() avoids the aggregation framework's pipeline setup.
+        # The projection excludes _id, so campaigns_daily_report covers the query (index-only)
+        cursor = campaigns_collection.find(
+            {"createdAt": {"$gte": day_start, "$lt": day_end}},
+            projection={"_id": 0, "name": 1, "status": 1, "createdAt": 1}
+        ).batch_size(1000)
+        for campaign in cursor:
+            if isinstance(campaign.get('createdAt'), datetime):
+                # Same output as strftime('%Y-%m-%d %H:%M:%S') without parsing a format string
+                campaign['createdAt'] = campaign['createdAt'].isoformat(sep=' ', timespec='seconds')
+            writer.writerow((campaign.get('name', ''), campaign.get('status', ''), campaign.get('createdAt', '')))
+            results.append(campaign)
+    except PyMongoError as e:
+        console.print(f"[red]Error querying campaigns: {e}[/red]")
+        return None
 
-    except Exception as e:
-        console.print(f"[red]Error generating report: {e}[/red]")
+    # Nothing to archive or attach on empty days
+    if not results:
+        console.print("[red]No campaigns created today.[/red]")
+        return None, [], None
+
+    csv_bytes = csv_buffer.getvalue().encode('utf-8')
+    try:
+        with open(output_file, 'wb') as csvfile:
+            csvfile.write(csv_bytes)
+    except OSError as e:
+        console.print(f"[red]Error writing report file: {e}[/red]")
         return None
 
-    finally:
-        if client:
-            client.close()
+    console.print(
+        f"[green]Report generated: {output_file}[/green]\n"
+        f"[green]Total campaigns created today: {len(results)}[/green]"
+    )
+    logger.info("Campaigns created today:\n%s", "\n".join(f"- {c.get('name', '')}" for c in results))
 
-def send_email_report_sendgrid(report_path, campaigns):
-    load_dotenv()
-    api_key = os.getenv("SENDGRID_API_KEY")
-    sender_email = os.getenv("EMAIL_SENDER")
-    sender_name = os.getenv("EMAIL_SENDER_NAME", "Campaign Bot")
-    recipient_email = os.getenv("EMAIL_RECIPIENT")
+    return output_file, results, csv_bytes
 
-    if not all([api_key, sender_email, recipient_email]):
+def send_email_report_sendgrid(report_path, campaigns, csv_bytes, report_date):
+    if not all([SENDGRID_API_KEY, EMAIL_SENDER, EMAIL_RECIPIENTS]):
         console.print("[red]Missing SendGrid email environment variables[/red]")
         return False
 
-    try:
-        with open(report_path, 'rb') as f:
-            data = f.read()
-            encoded_file = base64.b64encode(data).decode()
-
-        html_content = generate_html_table(campaigns)
-
-        message = Mail(
-            from_email=(sender_email, sender_name),
-            to_emails=recipient_email,
-            subject=f'Daily Campaign Report - {datetime.utcnow().strftime("%Y-%m-%d")}',
-            html_content=html_content
-        )
-
+    html_content = generate_html_table(campaigns)
+
+    message = Mail(
+        from_email=(EMAIL_SENDER, EMAIL_SENDER_NAME),
+        to_emails=EMAIL_RECIPIENTS,
+        # One personalization per recipient: a single API call, attachment sent once,
+        # and recipients do not see each other's addresses
+        is_multiple=True,
+        subject=f'Daily Campaign Report - {report_date.isoformat()}',
+        html_content=html_content
+    )
+
+    # Empty days send the "no campaigns" body without an attachment
+    if csv_bytes:
+        # CSV text compresses well; gzip before base64 to shrink the upload
+        encoded_file = base64.b64encode(gzip.compress(csv_bytes, compresslevel=6)).decode('ascii')
         attachment = Attachment(
             FileContent(encoded_file),
-            FileName(os.path.basename(report_path)),
-            FileType('text/csv'),
+            FileName(f"{os.path.basename(report_path)}.gz"),
+            FileType('application/gzip'),
             Disposition('attachment')
         )
         message.attachment = attachment
 
-        sg = SendGridAPIClient(api_key)
-        response = sg.send(message)
-
-        if 200 <= response.status_code < 300:
-            console.print("[green]Email sent successfully via SendGrid[/green]")
-            return True
-        else:
-            console.print(f"[red]Failed to send email: {response.status_code}[/red]")
+    sg = _sendgrid_client(SENDGRID_API_KEY)
+    for attempt in range(SEND_RETRIES + 1):
+        try:
+            response = sg.send(message)
+            break
+        except HTTPError as e:
+            # SendGrid raises HTTPError for every non-2xx reply; only 5xx is worth retrying
+            if e.status_code >= 500 and attempt < SEND_RETRIES:
+                delay = SEND_RETRY_DELAY * 2 ** attempt
+                console.print(f"[yellow]SendGrid returned {e.status_code}, retrying in {delay}s[/yellow]")
+                time.sleep(delay)
+                continue
+            console.print(f"[red]Failed to send email: {e.status_code} {e.body}[/red]")
+            return False
+        except OSError as e:
+            # Network-level failures (DNS, refused connection, timeout) surface as URLError/OSError
+            console.print(f"[red]Exception sending email: {e}[/red]")
             return False
 
-    except Exception as e:
-        console.print(f"[red]Exception sending email: {e}[/red]")
-        return False
+    if 200 <= response.status_code < 300:
+        console.print("[green]Email sent successfully via SendGrid[/green]")
+        return True
+    console.print(f"[red]Failed to send email: {response.status_code}[/red]")
+    return False
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     console.print("[bold blue]Campaign Report Generator[/bold blue]")
-    result = generate_campaign_report()
+
+    # Fail fast before touching MongoDB if the run could not complete anyway
+    missing = [name for name, value in REQUIRED_SETTINGS.items() if not value]
+    if missing:
+        console.print(f"[red]Missing required environment variables: {', '.join(missing)}[/red]")
+        return
+
+    today = datetime.now(timezone.utc).date()
+    result = generate_campaign_report(today)
     if result is None:
         console.print("[red]Failed to generate campaign report[/red]")
         return
 
-    file_path, campaigns = result
+    file_path, campaigns, csv_bytes = result
     if file_path:
         console.print(f"[green]Report saved at: {file_path}[/green]")
-        send_email_report_sendgrid(file_path, campaigns)
     else:
-        console.print("[red]No report file to send[/red]")
+        console.print("[yellow]No report file written; sending notice without attachment[/yellow]")
+    send_email_report_sendgrid(file_path, campaigns, csv_bytes, today)
 
 if __name__ == "__main__":
     main()